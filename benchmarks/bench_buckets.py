@@ -0,0 +1,80 @@
+"""
+Microbenchmark of the per-decision cost of `Buckets._has_capacity`, compared to
+the list-based implementation it replaced.
+
+Usage: python benchmarks/bench_buckets.py
+"""
+
+# Standard library
+import time
+import timeit
+
+# Local
+from openlimit.buckets import Bucket, Buckets
+
+# Decisions per timing run
+NUMBER = 200000
+
+
+#########
+# HELPERS
+#########
+
+
+class ListBuckets(object):
+    """
+    The previous implementation: per-bucket `Bucket` objects and temporary lists.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+
+    def _has_capacity(self, amounts):
+        current_time = time.time()
+        new_capacities = [
+            bucket._get_capacity(current_time=current_time) for bucket in self.buckets
+        ]
+
+        has_capacity = min(
+            [
+                amount <= new_capacity
+                for amount, new_capacity in zip(amounts, new_capacities)
+            ]
+        )
+
+        if has_capacity:
+            new_capacities = [
+                new_capacity - amount
+                for new_capacity, amount in zip(new_capacities, amounts)
+            ]
+
+        for new_capacity, bucket in zip(new_capacities, self.buckets):
+            bucket._set_capacity(new_capacity, current_time=current_time)
+
+        return has_capacity
+
+
+def time_per_decision(buckets, amounts):
+    runs = timeit.repeat(lambda: buckets._has_capacity(amounts), number=NUMBER, repeat=5)
+    return min(runs) / NUMBER * 1e9
+
+
+######
+# MAIN
+######
+
+
+if __name__ == "__main__":
+    for num_buckets in (2, 4):
+        for name, rate_limit, amount in (("admit", 1e12, 1.0), ("reject", 1, 5.0)):
+            amounts = [amount] * num_buckets
+            before = time_per_decision(
+                ListBuckets([Bucket(rate_limit, 1) for _ in range(num_buckets)]), amounts
+            )
+            after = time_per_decision(
+                Buckets([Bucket(rate_limit, 1) for _ in range(num_buckets)]), amounts
+            )
+
+            print(
+                f"{num_buckets} buckets, {name}: {before:.0f} ns -> {after:.0f} ns per decision"
+            )
@@ -1,2 +1,3 @@
 from openlimit.rate_limiters import ChatRateLimiter, CompletionRateLimiter, EmbeddingRateLimiter
-from openlimit.redis_rate_limiters import ChatRateLimiterWithRedis, CompletionRateLimiterWithRedis, EmbeddingRateLimiterWithRedis
\ No newline at end of file
+from openlimit.redis_rate_limiters import ChatRateLimiterWithRedis, CompletionRateLimiterWithRedis, EmbeddingRateLimiterWithRedis
+from openlimit.rate_limiter_pool import RateLimiterPool
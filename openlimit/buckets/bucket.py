@@ -9,12 +9,17 @@ import typing
 
 
 class Bucket(object):
-    def __init__(self, rate_limit, bucket_size_in_seconds: float = 1):
+    def __init__(
+        self,
+        rate_limit,
+        bucket_size_in_seconds: float = 1,
+        window_in_seconds: float = 60,
+    ):
         # Per-second rate limit
-        self._rate_per_sec = rate_limit / 60
+        self._rate_per_sec = rate_limit / window_in_seconds
 
         # Capacity of the bucket
-        self._capacity = rate_limit / 60 * bucket_size_in_seconds
+        self._capacity = self._rate_per_sec * bucket_size_in_seconds
 
         # The integration time of the bucket
         self._bucket_size_in_seconds = bucket_size_in_seconds
@@ -1,7 +1,7 @@
 # Standard library
 import asyncio
 import time
-from typing import Optional
+from array import array
 
 from openlimit.buckets.bucket import Bucket
 
@@ -11,77 +11,134 @@ from openlimit.buckets.bucket import Bucket
 
 
 class Buckets(object):
+    """
+    Tracks several buckets that are always debited together. Their state is
+    copied out of the `Bucket` objects into flat arrays, so checking and debiting
+    them is a single loop over plain floats. The `Bucket` objects are only read
+    at construction and aren't kept.
+    """
+
+    __slots__ = (
+        "_num_buckets",
+        "_rates",
+        "_max_capacities",
+        "_capacities",
+        "_next_capacities",
+        "_last_checked",
+    )
+
     def __init__(self, buckets: list[Bucket]) -> None:
-        self.buckets = buckets
+        self._num_buckets = len(buckets)
 
-    def _get_capacities(
-        self,
-        current_time: Optional[float] = None,
-    ):
+        # Per-second rates and full capacities of the buckets
+        self._rates = array("d", [bucket._rate_per_sec for bucket in buckets])
+        self._max_capacities = array(
+            "d",
+            [
+                bucket._rate_per_sec * bucket._bucket_size_in_seconds
+                for bucket in buckets
+            ],
+        )
 
-        if current_time is None:
-            current_time = time.time()
+        # Current capacities, plus a spare array that the next debit is written to
+        self._capacities = array("d", [bucket._capacity for bucket in buckets])
+        self._next_capacities = array("d", self._capacities)
 
-        new_capacities = [
-            bucket._get_capacity(current_time=current_time) for bucket in self.buckets
-        ]
+        # The buckets are always updated together, so they share one timestamp
+        self._last_checked = min(
+            [bucket._last_checked for bucket in buckets], default=time.time()
+        )
 
-        return new_capacities
+    def _has_capacity(self, amounts: list[float]):
 
-    def _set_capacities(
-        self,
-        new_capacities: list[float],
-        current_time: Optional[float] = None,
-    ):
+        # Create the current time
+        current_time = time.time()
+        time_passed = current_time - self._last_checked
 
-        if current_time is None:
-            current_time = time.time()
+        capacities = self._capacities
+        next_capacities = self._next_capacities
+        max_capacities = self._max_capacities
+        rates = self._rates
 
-        for new_capacity, bucket in zip(new_capacities, self.buckets):
+        # Refill each bucket and remove its amount, stopping (without writing any
+        # state) at the first bucket that doesn't have enough capacity
+        for i in range(self._num_buckets):
+            capacity = capacities[i] + time_passed * rates[i]
+            if capacity > max_capacities[i]:
+                capacity = max_capacities[i]
 
-            bucket._set_capacity(
-                new_capacity,
-                current_time=current_time,
-            )
+            if amounts[i] > capacity:
+                return False
 
-    def _has_capacity(self, amounts: list[float]):
+            next_capacities[i] = capacity - amounts[i]
+
+        # Every bucket had enough, so the debited capacities become current
+        self._capacities = next_capacities
+        self._next_capacities = capacities
+        self._last_checked = current_time
+
+        return True
+
+    def _refund(self, amounts: list[float]):
 
         # Create the current time
         current_time = time.time()
+        time_passed = current_time - self._last_checked
 
-        # Get the new capacities
-        new_capacities = self._get_capacities(current_time=current_time)
+        capacities = self._capacities
+        max_capacities = self._max_capacities
+        rates = self._rates
 
-        # Determine if we have sufficient capacity
-        has_capacity = min(
-            [
-                amount <= new_capacity
-                for amount, new_capacity in zip(amounts, new_capacities)
-            ]
-        )
+        # Refill each bucket and add its amount back, up to the bucket's size
+        for i in range(self._num_buckets):
+            capacity = capacities[i] + time_passed * rates[i] + amounts[i]
+            if capacity > max_capacities[i]:
+                capacity = max_capacities[i]
+
+            capacities[i] = capacity
+
+        self._last_checked = current_time
+
+    def _acquire(self, amounts: list[float]):
+
+        if self._has_capacity(amounts):
+            return True, 0.0
+
+        return False, self._get_wait_time(amounts)
+
+    def _get_wait_time(self, amounts: list[float]):
+
+        # Create the current time
+        current_time = time.time()
+        time_passed = current_time - self._last_checked
+
+        capacities = self._capacities
+        max_capacities = self._max_capacities
+        rates = self._rates
 
-        # If there is enough capacity, remove the amount
-        if has_capacity:
-            new_capacities = [
-                new_capacity - amount
-                for new_capacity, amount in zip(new_capacities, amounts)
-            ]
+        # Time until every bucket has refilled enough to cover its amount
+        wait_time = 0.0
+        for i in range(self._num_buckets):
+            capacity = capacities[i] + time_passed * rates[i]
+            if capacity > max_capacities[i]:
+                capacity = max_capacities[i]
 
-        # Set the new capacities
-        self._set_capacities(new_capacities, current_time=current_time)
+            bucket_wait_time = (amounts[i] - capacity) / rates[i]
+            if bucket_wait_time > wait_time:
+                wait_time = bucket_wait_time
 
-        return has_capacity
+        return wait_time
 
     def wait_for_capacity_sync(
         self, amounts: list[float], sleep_interval: float = 1e-1
     ):
 
         while not self._has_capacity(amounts):
-            time.sleep(sleep_interval)
+            time.sleep(max(self._get_wait_time(amounts), sleep_interval))
 
     async def wait_for_capacity(
         self, amounts: list[float], sleep_interval: float = 1e-1
     ):
 
         while not self._has_capacity(amounts):
-            await asyncio.sleep(sleep_interval)
+            await asyncio.sleep(max(self._get_wait_time(amounts), sleep_interval))
@@ -17,9 +17,11 @@ class RedisBucket(object):
         bucket_key,
         redis: redis.asyncio.Redis,
         bucket_size_in_seconds: float = 1,
+        window_in_seconds: float = 60,
+        field_name: typing.Optional[str] = None,
     ):
         # Per-second rate limit
-        self._rate_per_sec = rate_limit / 60
+        self._rate_per_sec = rate_limit / window_in_seconds
 
         # The integration time of the bucket
         self._bucket_size_in_seconds = bucket_size_in_seconds
@@ -28,9 +30,12 @@ class RedisBucket(object):
         self._redis = redis
         self._bucket_key = bucket_key
 
+        # Prefix of this bucket's fields when state is kept in a shared hash
+        self._field_name = field_name or bucket_key
+
     def _lock(self, **kwargs):
 
-        return redis.asyncio.lock.Lock(self._redis, f"{self._bucket_key}:lock", **kwargs)
+        return self._redis.lock(self._key("lock"), **kwargs)
 
     async def _get_capacity(
         self,
@@ -41,14 +46,18 @@ class RedisBucket(object):
         if pipeline is None:
             pipeline = self._redis.pipeline()
 
-        pipeline.get(f"{self._bucket_key}:last_checked")
-        pipeline.get(f"{self._bucket_key}:capacity")
+        pipeline.get(self._key("last_checked"))
+        pipeline.get(self._key("capacity"))
 
         if current_time is None:
             current_time = time.time()
 
         last_checked, capacity = await pipeline.execute()
 
+        return self._refill(last_checked, capacity, current_time)
+
+    def _refill(self, last_checked, capacity, current_time: float):
+
         if not last_checked or not capacity:
             last_checked = current_time
             capacity = self._rate_per_sec * self._bucket_size_in_seconds
@@ -75,8 +84,18 @@ class RedisBucket(object):
         if current_time is None:
             current_time = time.time()
 
-        pipeline.set(f"{self._bucket_key}:last_checked", current_time)
-        pipeline.set(f"{self._bucket_key}:capacity", new_capacity)
+        pipeline.set(self._key("last_checked"), current_time)
+        pipeline.set(self._key("capacity"), new_capacity)
 
         if execute:
             await pipeline.execute()
+
+    def _key(self, name: str):
+
+        # Redis key of this bucket
+        return f"{self._bucket_key}:{name}"
+
+    def _field(self, name: str):
+
+        # Field of this bucket, when state is kept in a shared hash
+        return f"{self._field_name}:{name}"
@@ -1,3 +1,4 @@
+import math
 import time
 from contextlib import AsyncExitStack, ExitStack
 from typing import Optional
@@ -6,17 +7,59 @@ import redis
 from openlimit.buckets.redis_bucket import RedisBucket
 import openlimit.utilities as utils
 
+# Seconds to wait before subscribing to the wake-up channel again after a failure
+RESUBSCRIBE_INTERVAL = 5
+
 class RedisBuckets(object):
-    def __init__(self, buckets: list[RedisBucket], redis: redis.asyncio.Redis) -> None:
+    def __init__(
+        self,
+        buckets: list[RedisBucket],
+        redis: redis.asyncio.Redis,
+        hash_key: Optional[str] = None,
+        channel: Optional[str] = None,
+        lock_blocking_timeout: Optional[float] = None,
+        lock_timeout: float = 2,
+    ) -> None:
         self.buckets = buckets
         self._redis = redis
 
+        # If set, the state of all buckets is kept in this single Redis hash, which
+        # expires once every bucket would have refilled completely anyway
+        self._hash_key = hash_key
+        self._hash_ttl = max(
+            math.ceil(max(bucket._bucket_size_in_seconds for bucket in buckets)), 1
+        )
+
+        # How long to wait for the bucket locks (forever if None), and how long a
+        # held lock lasts before it expires
+        self._lock_blocking_timeout = lock_blocking_timeout
+        self._lock_timeout = lock_timeout
+
+        # If set, refunds are announced on this Redis pub/sub channel
+        self._channel = channel
+        self._waiters = None
+        self._listener = None
+        self._listener_failed_at = 0.0
+
     async def _lock(self, **kwargs):
 
+        kwargs.setdefault("timeout", self._lock_timeout)
+        kwargs.setdefault("blocking_timeout", self._lock_blocking_timeout)
         stack = AsyncExitStack()
 
-        for bucket in self.buckets:
-            await stack.enter_async_context(bucket._lock(**kwargs))
+        try:
+            if self._hash_key:
+                await stack.enter_async_context(
+                    self._redis.lock(f"{self._hash_key}:lock", **kwargs)
+                )
+                return stack
+
+            for bucket in self.buckets:
+                await stack.enter_async_context(bucket._lock(**kwargs))
+        except BaseException:
+            # Release the locks that were already acquired
+            await stack.aclose()
+            raise
 
         return stack
 
@@ -32,6 +75,19 @@ class RedisBuckets(object):
         if current_time is None:
             current_time = time.time()
 
+        if self._hash_key:
+            fields = []
+            for bucket in self.buckets:
+                fields += [bucket._field("last_checked"), bucket._field("capacity")]
+
+            pipeline.hmget(self._hash_key, fields)
+            (values,) = await pipeline.execute()
+
+            return [
+                bucket._refill(values[2 * i], values[2 * i + 1], current_time)
+                for i, bucket in enumerate(self.buckets)
+            ]
+
         new_capacities = [
             await bucket._get_capacity(pipeline=pipeline, current_time=current_time)
             for bucket in self.buckets
@@ -52,6 +108,17 @@ class RedisBuckets(object):
         if current_time is None:
             current_time = time.time()
 
+        if self._hash_key:
+            mapping = {}
+            for new_capacity, bucket in zip(new_capacities, self.buckets):
+                mapping[bucket._field("last_checked")] = current_time
+                mapping[bucket._field("capacity")] = new_capacity
+
+            pipeline.hset(self._hash_key, mapping=mapping)
+            pipeline.expire(self._hash_key, self._hash_ttl)
+            await pipeline.execute()
+            return
+
         for new_capacity, bucket in zip(new_capacities, self.buckets):
 
             await bucket._set_capacity(
@@ -63,51 +130,220 @@ class RedisBuckets(object):
 
         await pipeline.execute()
 
+    def _get_wait_time(self, amounts: list[float], new_capacities: list[float]):
+
+        # Time until every bucket has refilled enough to cover its amount
+        wait_time = max(
+            [
+                (amount - new_capacity) / bucket._rate_per_sec
+                for amount, new_capacity, bucket in zip(
+                    amounts, new_capacities, self.buckets
+                )
+            ]
+        )
+
+        return max(wait_time, 0.0)
+
+    async def _acquire_async(self, amounts: list[float]):
+
+        # Lock all the buckets. If another caller holds them for too long, this
+        # isn't admitted yet and should retry
+        try:
+            lock = await self._lock()
+        except redis.exceptions.LockError:
+            return False, 0.0
+
+        # If the lock expired before it was released, another caller may have
+        # written in between, so this decision doesn't count
+        try:
+            async with lock:
+                return await self._acquire_locked(amounts)
+        except redis.exceptions.LockNotOwnedError:
+            return False, 0.0
+
+    async def _acquire_locked(self, amounts: list[float]):
+
+        # Create the pipeline and current time
+        pipeline = self._redis.pipeline()
+        current_time = time.time()
+
+        # Get the new capacities
+        new_capacities = await self._get_capacities(
+            pipeline=pipeline, current_time=current_time
+        )
+
+        # Determine if we have sufficient capacity
+        has_capacity = min(
+            [
+                amount <= new_capacity
+                for amount, new_capacity in zip(amounts, new_capacities)
+            ]
+        )
+
+        # If not, tell the caller how long until there is. Nothing needs to be
+        # written, since the refill is derived from the last write
+        if not has_capacity:
+            return False, self._get_wait_time(amounts, new_capacities)
+
+        # Otherwise, remove the amount
+        new_capacities = [
+            new_capacity - amount
+            for new_capacity, amount in zip(new_capacities, amounts)
+        ]
+
+        # Set the new capacities
+        await self._set_capacities(
+            new_capacities, pipeline=pipeline, current_time=current_time
+        )
+
+        return True, 0.0
+
     async def _has_capacity_async(self, amounts: list[float]):
 
-        # Lock all the buckets
-        async with await self._lock(timeout=2):
+        has_capacity, _ = await self._acquire_async(amounts)
+        return has_capacity
 
-            # Create the pipeline and current time
-            pipeline = self._redis.pipeline()
-            current_time = time.time()
+    async def _get_wait_time_async(self, amounts: list[float]):
 
-            # Get the new capacities
-            new_capacities = await self._get_capacities(
-                pipeline=pipeline, current_time=current_time
-            )
+        # Create the pipeline and current time
+        pipeline = self._redis.pipeline()
+        current_time = time.time()
 
-            # Determine if we have sufficient capacity
-            has_capacity = min(
-                [
-                    amount <= new_capacity
-                    for amount, new_capacity in zip(amounts, new_capacities)
-                ]
-            )
+        # Get the new capacities (an estimate, so no lock is taken)
+        new_capacities = await self._get_capacities(
+            pipeline=pipeline, current_time=current_time
+        )
+
+        return self._get_wait_time(amounts, new_capacities)
+
+    async def refund(self, amounts: list[float]):
+
+        # Lock all the buckets, waiting as long as it takes so the refund isn't lost.
+        # If the lock expired before it was released, the refund was still written
+        try:
+            async with await self._lock(blocking_timeout=None):
+                await self._refund_locked(amounts)
+        except redis.exceptions.LockNotOwnedError:
+            pass
 
-            # If there is enough capacity, remove the amount
-            if has_capacity:
-                new_capacities = [
-                    new_capacity - amount
-                    for new_capacity, amount in zip(new_capacities, amounts)
-                ]
+        # Wake up waiters on every node, since they may fit in the freed capacity
+        if self._channel:
+            await self._redis.publish(self._channel, "refund")
 
-            # Set the new capacities
-            await self._set_capacities(
-                new_capacities, pipeline=pipeline, current_time=current_time
+    async def _refund_locked(self, amounts: list[float]):
+
+        # Create the pipeline and current time
+        pipeline = self._redis.pipeline()
+        current_time = time.time()
+
+        # Add the amounts back, up to each bucket's size
+        new_capacities = await self._get_capacities(
+            pipeline=pipeline, current_time=current_time
+        )
+        new_capacities = [
+            min(
+                bucket._rate_per_sec * bucket._bucket_size_in_seconds,
+                new_capacity + amount,
+            )
+            for new_capacity, amount, bucket in zip(
+                new_capacities, amounts, self.buckets
             )
+        ]
 
-        return has_capacity
+        await self._set_capacities(
+            new_capacities, pipeline=pipeline, current_time=current_time
+        )
+
+    def _get_waiters(self, listen: bool = True):
+
+        # Per event loop: a lock that lets one waiter at a time poll Redis, and an
+        # event that is set when capacity is freed on any node. Without `listen`, the
+        # event is only set by timeouts, and no listener is left behind on the loop
+        loop = asyncio.get_running_loop()
+        if self._waiters is None or self._waiters[0] is not loop:
+            self._stop_listener()
+            self._waiters = (loop, asyncio.Lock(), asyncio.Event())
+
+        # (Re)subscribe, unless the last attempt failed only recently
+        listener_idle = self._listener is None or self._listener.done()
+        retry_due = time.time() - self._listener_failed_at >= RESUBSCRIBE_INTERVAL
+        if listen and self._channel and listener_idle and retry_due:
+            self._listener = loop.create_task(self._listen(self._waiters[2]))
+
+        return self._waiters[1], self._waiters[2]
+
+    def _stop_listener(self):
+
+        listener, self._listener = self._listener, None
+        if listener is None or listener.done():
+            return
+
+        # A closed loop has already dropped its tasks
+        if not listener.get_loop().is_closed():
+            listener.cancel()
+
+    async def _listen(self, wake_event: asyncio.Event):
+
+        pubsub = self._redis.pubsub()
+
+        try:
+            await pubsub.subscribe(self._channel)
+
+            async for message in pubsub.listen():
+                if message["type"] == "message":
+                    wake_event.set()
+        except Exception:
+            # Waiters still wake up when their capacity is due
+            self._listener_failed_at = time.time()
+        finally:
+            await pubsub.aclose()
+
+    async def close(self):
+
+        # Stops listening for wake-ups and closes the pub/sub connection
+        listener = self._listener
+        self._stop_listener()
+
+        if listener is not None:
+            await asyncio.gather(listener, return_exceptions=True)
 
     async def wait_for_capacity(
-        self, amounts: list[float], sleep_interval: float = 1e-1
+        self,
+        amounts: list[float],
+        sleep_interval: float = 1e-1,
+        acquire=None,
+        listen: bool = True,
     ):
 
-        while not await self._has_capacity_async(amounts):
-            await asyncio.sleep(sleep_interval)
+        # `acquire` makes one admission attempt, returning whether it succeeded and
+        # otherwise how long until it could. It defaults to checking these buckets
+        if acquire is None:
+            acquire = lambda: self._acquire_async(amounts)
+
+        lock, wake_event = self._get_waiters(listen=listen)
+
+        # Waiters queue up locally, so only the first one hits Redis. It sleeps until
+        # its capacity is due, or until capacity is freed
+        async with lock:
+            while True:
+                wake_event.clear()
+
+                has_capacity, wait_time = await acquire()
+                if has_capacity:
+                    return
+
+                try:
+                    await asyncio.wait_for(
+                        wake_event.wait(), timeout=max(wait_time, sleep_interval)
+                    )
+                except asyncio.TimeoutError:
+                    pass
 
     def wait_for_capacity_sync(
         self, amounts: list[float], sleep_interval: float = 1e-1
     ):
         loop = utils.ensure_event_loop()
-        loop.run_until_complete(self.wait_for_capacity(amounts, sleep_interval=sleep_interval))
+        # The loop sits idle between sync calls, so don't leave a listener on it
+        loop.run_until_complete(
+            self.wait_for_capacity(amounts, sleep_interval=sleep_interval, listen=False)
+        )
@@ -0,0 +1,157 @@
+# Standard library
+import asyncio
+import time
+
+# Local
+import openlimit.utilities as utils
+
+######
+# MAIN
+######
+
+
+class RateLimiterPool(object):
+    """
+    Load-balances requests across several rate limiters (e.g. one per API key
+    or deployment), admitting each request on the limiter with the earliest
+    available capacity. Entering `limit()` returns the key of the chosen limiter.
+    """
+
+    def __init__(
+        self,
+        rate_limiters: dict,
+        token_counter=None,
+        token_counter_threshold: int = utils.DEFAULT_OFFLOAD_THRESHOLD,
+        token_counter_executor=None,
+    ):
+        if not rate_limiters:
+            raise ValueError("At least one rate limiter is required.")
+
+        # Rate limiters, keyed by API key or deployment name
+        self.rate_limiters = rate_limiters
+
+        # Token counter (defaults to the counter of the pooled limiters)
+        if token_counter is None:
+            token_counter = next(iter(rate_limiters.values())).token_counter
+
+        self.token_counter = token_counter
+
+        # Where async calls count tokens for large requests
+        self._token_counter_threshold = token_counter_threshold
+        self._token_counter_executor = token_counter_executor
+
+        # Rotating offset for breaking ties between limiters, and the per-loop lock
+        # that pool waiters queue on
+        self._offset = 0
+        self._lock = None
+
+        # Fallback polling interval, used when every limiter is contended
+        self.sleep_interval = min(
+            rate_limiter.sleep_interval for rate_limiter in rate_limiters.values()
+        )
+
+    def _get_sleep_time(self, wait_times: dict):
+        min_wait_time = min(wait_times.values())
+        return min_wait_time if min_wait_time > 0 else self.sleep_interval
+
+    def _get_order(self, wait_times: dict):
+        # Limiters in order of earliest available capacity. Ties are broken by a
+        # rotating offset, so equal keys share the traffic
+        keys = list(self.rate_limiters)
+        offset = self._offset % len(keys)
+        self._offset += 1
+
+        return sorted(keys[offset:] + keys[:offset], key=wait_times.get)
+
+    def _get_lock(self):
+        # Per event loop, so pool waiters queue up locally
+        loop = asyncio.get_running_loop()
+        if self._lock is None or self._lock[0] is not loop:
+            self._lock = (loop, asyncio.Lock())
+
+        return self._lock[1]
+
+    async def _sleep(self, sleep_time: float, wake_events: list):
+        if not wake_events:
+            await asyncio.sleep(sleep_time)
+            return
+
+        # Wake up early if capacity is freed on any of the Redis-backed limiters
+        waits = [asyncio.ensure_future(wake_event.wait()) for wake_event in wake_events]
+        try:
+            await asyncio.wait(
+                waits, timeout=sleep_time, return_when=asyncio.FIRST_COMPLETED
+            )
+        finally:
+            for wait in waits:
+                wait.cancel()
+
+    async def wait_for_capacity(self, num_tokens):
+        # Only the first pool waiter reads the limiters' state. It sleeps until the
+        # earliest capacity is due, or until capacity is freed
+        async with self._get_lock():
+            while True:
+                wake_events = [
+                    wake_event
+                    for wake_event in await asyncio.gather(
+                        *[
+                            rate_limiter._get_wake_event()
+                            for rate_limiter in self.rate_limiters.values()
+                        ]
+                    )
+                    if wake_event is not None
+                ]
+                for wake_event in wake_events:
+                    wake_event.clear()
+
+                # Fetch the wait times concurrently (one round trip for Redis limiters)
+                wait_times = dict(
+                    zip(
+                        self.rate_limiters.keys(),
+                        await asyncio.gather(
+                            *[
+                                rate_limiter._get_wait_time_async(num_tokens)
+                                for rate_limiter in self.rate_limiters.values()
+                            ]
+                        ),
+                    )
+                )
+
+                for key in self._get_order(wait_times):
+                    if wait_times[key] > 0:
+                        break
+
+                    if await self.rate_limiters[key]._has_capacity_async(num_tokens):
+                        return key
+
+                await self._sleep(self._get_sleep_time(wait_times), wake_events)
+
+    def wait_for_capacity_sync(self, num_tokens):
+        while True:
+            wait_times = {
+                key: rate_limiter._get_wait_time(num_tokens)
+                for key, rate_limiter in self.rate_limiters.items()
+            }
+
+            for key in self._get_order(wait_times):
+                if wait_times[key] > 0:
+                    break
+
+                if self.rate_limiters[key]._has_capacity(num_tokens):
+                    return key
+
+            time.sleep(self._get_sleep_time(wait_times))
+
+    async def _count_tokens_async(self, request_params):
+        return await utils.count_tokens_async(
+            self.token_counter,
+            request_params,
+            threshold=self._token_counter_threshold,
+            executor=self._token_counter_executor,
+        )
+
+    def limit(self, **kwargs):
+        return utils.ContextManager(kwargs, self)
+
+    def is_limited(self):
+        return utils.FunctionDecorator(self)
@@ -17,14 +17,22 @@ class RateLimiter(object):
         token_limit,
         token_counter,
         bucket_size_in_seconds: float = 1,
+        token_counter_threshold: int = utils.DEFAULT_OFFLOAD_THRESHOLD,
+        token_counter_executor=None,
     ):
-        # Rate limits
+        # Rate limits, each either per-minute or a list of (amount, window_in_seconds)
         self.request_limit = request_limit
         self.token_limit = token_limit
-        self.sleep_interval = 1 / (self.request_limit / 60)
+        self._request_limits = utils.normalize_rate_limit(request_limit)
+        self._token_limits = utils.normalize_rate_limit(token_limit)
+        self.sleep_interval = min(
+            window / amount for amount, window in self._request_limits
+        )
 
-        # Token counter
+        # Token counter, and where async calls count tokens for large requests
         self.token_counter = token_counter
+        self._token_counter_threshold = token_counter_threshold
+        self._token_counter_executor = token_counter_executor
 
         # Bucket size in seconds
         self._bucket_size_in_seconds = bucket_size_in_seconds
@@ -32,24 +40,54 @@ class RateLimiter(object):
         # Buckets
         self._buckets = Buckets(
             buckets=[
-                Bucket(request_limit, bucket_size_in_seconds),
-                Bucket(token_limit, bucket_size_in_seconds),
+                Bucket(
+                    amount,
+                    utils.bucket_size_for_window(bucket_size_in_seconds, window),
+                    window,
+                )
+                for amount, window in self._request_limits + self._token_limits
             ]
         )
 
+    def _get_amounts(self, num_tokens):
+        return [1] * len(self._request_limits) + [num_tokens] * len(self._token_limits)
+
     async def wait_for_capacity(self, num_tokens):
         await self._buckets.wait_for_capacity(
-            amounts=[1, num_tokens], sleep_interval=self.sleep_interval
+            amounts=self._get_amounts(num_tokens), sleep_interval=self.sleep_interval
         )
 
     def wait_for_capacity_sync(self, num_tokens):
         self._buckets.wait_for_capacity_sync(
-            amounts=[1, num_tokens], sleep_interval=self.sleep_interval
+            amounts=self._get_amounts(num_tokens), sleep_interval=self.sleep_interval
+        )
+
+    def _has_capacity(self, num_tokens):
+        return self._buckets._has_capacity(amounts=self._get_amounts(num_tokens))
+
+    def _get_wait_time(self, num_tokens):
+        return self._buckets._get_wait_time(amounts=self._get_amounts(num_tokens))
+
+    async def _has_capacity_async(self, num_tokens):
+        return self._has_capacity(num_tokens)
+
+    async def _get_wait_time_async(self, num_tokens):
+        return self._get_wait_time(num_tokens)
+
+    async def _get_wake_event(self):
+        # Capacity is only freed by refilling, which the wait times account for
+        return None
+
+    async def _count_tokens_async(self, request_params):
+        return await utils.count_tokens_async(
+            self.token_counter,
+            request_params,
+            threshold=self._token_counter_threshold,
+            executor=self._token_counter_executor,
         )
 
     def limit(self, **kwargs):
-        num_tokens = self.token_counter(**kwargs)
-        return utils.ContextManager(num_tokens, self)
+        return utils.ContextManager(kwargs, self)
 
     def is_limited(self):
         return utils.FunctionDecorator(self)
@@ -62,25 +100,39 @@ class RateLimiter(object):
 
 class ChatRateLimiter(RateLimiter):
     def __init__(
-        self, request_limit=3500, token_limit=90000, bucket_size_in_seconds: float = 1
+        self,
+        request_limit=3500,
+        token_limit=90000,
+        bucket_size_in_seconds: float = 1,
+        token_counter_threshold: int = utils.DEFAULT_OFFLOAD_THRESHOLD,
+        token_counter_executor=None,
     ):
         super().__init__(
             request_limit=request_limit,
             token_limit=token_limit,
             token_counter=utils.num_tokens_consumed_by_chat_request,
             bucket_size_in_seconds=bucket_size_in_seconds,
+            token_counter_threshold=token_counter_threshold,
+            token_counter_executor=token_counter_executor,
         )
 
 
 class CompletionRateLimiter(RateLimiter):
     def __init__(
-        self, request_limit=3500, token_limit=350000, bucket_size_in_seconds: float = 1
+        self,
+        request_limit=3500,
+        token_limit=350000,
+        bucket_size_in_seconds: float = 1,
+        token_counter_threshold: int = utils.DEFAULT_OFFLOAD_THRESHOLD,
+        token_counter_executor=None,
     ):
         super().__init__(
             request_limit=request_limit,
             token_limit=token_limit,
             token_counter=utils.num_tokens_consumed_by_completion_request,
             bucket_size_in_seconds=bucket_size_in_seconds,
+            token_counter_threshold=token_counter_threshold,
+            token_counter_executor=token_counter_executor,
         )
 
 
@@ -90,10 +142,14 @@ class EmbeddingRateLimiter(RateLimiter):
         request_limit=3500,
         token_limit=70000000,
         bucket_size_in_seconds: float = 1,
+        token_counter_threshold: int = utils.DEFAULT_OFFLOAD_THRESHOLD,
+        token_counter_executor=None,
     ):
         super().__init__(
             request_limit=request_limit,
             token_limit=token_limit,
             token_counter=utils.num_tokens_consumed_by_embedding_request,
             bucket_size_in_seconds=bucket_size_in_seconds,
+            token_counter_threshold=token_counter_threshold,
+            token_counter_executor=token_counter_executor,
         )
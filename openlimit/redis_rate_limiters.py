@@ -1,12 +1,23 @@
 # Standard library
 import asyncio
+import time
+import typing
+import uuid
 
 # Third party
 import redis
 
 # Local
 import openlimit.utilities as utils
-from openlimit.buckets import RedisBucket, RedisBuckets
+from openlimit.buckets import Bucket, Buckets, RedisBucket, RedisBuckets
+
+# Errors that mean Redis is unreachable or too slow, rather than a failed decision
+FAILOVER_ERRORS = (
+    redis.exceptions.ConnectionError,
+    redis.exceptions.TimeoutError,
+    redis.exceptions.RedisClusterException,
+    OSError,
+)
 
 ############
 # BASE CLASS
@@ -22,17 +33,36 @@ class RateLimiterWithRedis(object):
         bucket_key,
         redis_url="redis://localhost:5050",
         bucket_size_in_seconds: float = 1,
+        redis_cluster: bool = False,
+        compact_state: bool = False,
+        token_counter_threshold: int = utils.DEFAULT_OFFLOAD_THRESHOLD,
+        token_counter_executor=None,
+        failover: bool = False,
+        num_nodes: typing.Optional[int] = None,
+        min_num_nodes: typing.Optional[int] = None,
+        redis_timeout: float = 0.5,
+        failover_retry_interval: float = 5,
     ):
-        # Rate limits
+        # Rate limits, each either per-minute or a list of (amount, window_in_seconds)
         self.request_limit = request_limit
         self.token_limit = token_limit
-        self.sleep_interval = 1 / (self.request_limit / 60)
+        self._request_limits = utils.normalize_rate_limit(request_limit)
+        self._token_limits = utils.normalize_rate_limit(token_limit)
+        self.sleep_interval = min(
+            window / amount for amount, window in self._request_limits
+        )
 
-        # Token counter
+        # Token counter, and where async calls count tokens for large requests
         self.token_counter = token_counter
+        self._token_counter_threshold = token_counter_threshold
+        self._token_counter_executor = token_counter_executor
 
         # Redis
         self._redis_url = redis_url
+        self._redis_cluster = redis_cluster
+
+        # Whether to keep all limiter state in a single, self-expiring Redis hash
+        self._compact_state = compact_state
 
         # Bucket size in seconds
         self._bucket_size_in_seconds = bucket_size_in_seconds
@@ -40,51 +70,246 @@ class RateLimiterWithRedis(object):
         # Buckets
         self._buckets = None
 
-        # Bucket prefix (for Redis)
+        # Bucket prefix (for Redis). The hash tag keeps every key of this limiter
+        # in the same Redis Cluster slot, while different limiters spread across shards
         self._bucket_key = bucket_key
+        self._hash_tag = f"{{{bucket_key}}}"
+
+        # Failover. If Redis can't be reached within `redis_timeout`, this node falls
+        # back to in-memory buckets holding its share of the limits and retries Redis
+        # every `failover_retry_interval` seconds. The limits are split across
+        # `num_nodes`, or across the nodes seen via heartbeats but never fewer than
+        # `min_num_nodes` (which also applies before the first heartbeat succeeds)
+        if failover and num_nodes is None and min_num_nodes is None:
+            raise ValueError(
+                "Failover requires either num_nodes or min_num_nodes to be set."
+            )
+
+        self._failover = failover
+        self._num_nodes = num_nodes
+        self._min_num_nodes = min_num_nodes
+        self._redis_timeout = redis_timeout
+        self._failover_retry_interval = failover_retry_interval
+        self._node_id = uuid.uuid4().hex
+        self._num_nodes_seen = 0
+        self._last_heartbeat = 0
+        self._local_buckets = None
+        self._failed_at = None
 
     async def _init_buckets(self):
         if self._buckets:
             return
 
-        db = await redis.asyncio.from_url(
-            self._redis_url, encoding="utf-8", decode_responses=True
-        )
+        # Bound every Redis call, so a failover can't hang on a dead connection
+        timeouts = {}
+        if self._failover:
+            timeouts = {
+                "socket_timeout": self._redis_timeout,
+                "socket_connect_timeout": self._redis_timeout,
+            }
+
+        # The clients connect on their first command, so connection errors surface
+        # (and can fail over) there rather than here
+        if self._redis_cluster:
+            db = redis.asyncio.cluster.RedisCluster.from_url(
+                self._redis_url, encoding="utf-8", decode_responses=True, **timeouts
+            )
+        else:
+            db = redis.asyncio.from_url(
+                self._redis_url, encoding="utf-8", decode_responses=True, **timeouts
+            )
 
         self._buckets = RedisBuckets(
             redis=db,
+            hash_key=f"{self._hash_tag}_state" if self._compact_state else None,
+            lock_blocking_timeout=self._redis_timeout / 2 if self._failover else None,
+            lock_timeout=max(2, 2 * self._redis_timeout),
+            channel=f"{self._hash_tag}_wake",
             buckets=[
                 RedisBucket(
-                    self.request_limit,
-                    bucket_key=f"{self._bucket_key}_requests",
+                    amount,
+                    bucket_key=f"{self._hash_tag}_{self._get_bucket_name(name, window)}",
                     redis=db,
-                    bucket_size_in_seconds=self._bucket_size_in_seconds,
-                ),
-                RedisBucket(
-                    self.token_limit,
-                    bucket_key=f"{self._bucket_key}_tokens",
-                    redis=db,
-                    bucket_size_in_seconds=self._bucket_size_in_seconds,
-                ),
+                    bucket_size_in_seconds=utils.bucket_size_for_window(
+                        self._bucket_size_in_seconds, window
+                    ),
+                    window_in_seconds=window,
+                    field_name=self._get_bucket_name(name, window),
+                )
+                for name, rate_limits in (
+                    ("requests", self._request_limits),
+                    ("tokens", self._token_limits),
+                )
+                for amount, window in rate_limits
             ],
         )
 
-    async def wait_for_capacity(self, num_tokens):
+    def _get_bucket_name(self, name, window):
+        # Per-minute buckets keep their original names
+        if window == 60:
+            return name
+
+        return f"{name}_{window:g}s"
+
+    def _get_amounts(self, num_tokens):
+        return [1] * len(self._request_limits) + [num_tokens] * len(self._token_limits)
+
+    def _init_local_buckets(self):
+        num_nodes = self._num_nodes or max(self._num_nodes_seen, self._min_num_nodes)
+
+        # Each node refills at its share of the rate, but keeps the full bucket size,
+        # so a single request (or a large token count) always fits eventually
+        self._local_buckets = Buckets(
+            buckets=[
+                Bucket(
+                    amount / num_nodes,
+                    utils.bucket_size_for_window(self._bucket_size_in_seconds, window)
+                    * num_nodes,
+                    window,
+                )
+                for amount, window in self._request_limits + self._token_limits
+            ]
+        )
+
+    async def _heartbeat(self):
+        # Registers this node and counts the nodes seen recently
+        nodes_key = f"{self._hash_tag}_nodes"
+        current_time = time.time()
+        expiry = 3 * self._failover_retry_interval
+
+        pipeline = self._buckets._redis.pipeline()
+        pipeline.zadd(nodes_key, {self._node_id: current_time})
+        pipeline.zremrangebyscore(nodes_key, "-inf", current_time - expiry)
+        pipeline.zcard(nodes_key)
+        pipeline.expire(nodes_key, max(int(expiry), 1))
+        *_, num_nodes_seen, _ = await pipeline.execute()
+
+        self._num_nodes_seen = max(num_nodes_seen, 1)
+        self._last_heartbeat = current_time
+
+    async def _call_redis(self, redis_call):
+        heartbeat_due = (
+            time.time() - self._last_heartbeat >= self._failover_retry_interval
+        )
+        if self._num_nodes is None and heartbeat_due:
+            await self._heartbeat()
+
+        return await redis_call()
+
+    async def _with_failover(self, redis_call, local_call):
+        if not self._failover:
+            return await redis_call()
+
+        # While Redis is down, only retry it every so often
+        if self._failed_at is not None:
+            if time.time() - self._failed_at < self._failover_retry_interval:
+                return local_call()
+
+        # The whole decision is bounded by redis_timeout. Lock acquisition gives up
+        # halfway through, since lock contention just means "not admitted yet".
+        # Only a connection error or a decision that runs out of time means Redis is
+        # down. Cancelling a decision is safe: its writes are a single transaction,
+        # and a held lock expires on its own
+        try:
+            result = await asyncio.wait_for(
+                self._call_redis(redis_call), timeout=self._redis_timeout
+            )
+        except FAILOVER_ERRORS + (asyncio.TimeoutError,):
+            if self._local_buckets is None:
+                self._init_local_buckets()
+
+            self._failed_at = time.time()
+            return local_call()
+
+        # Redis is reachable (again), so its shared state is used from here on. The
+        # local debits aren't written back: each node stayed within its share of the
+        # limits, while the Redis buckets kept refilling during the outage. So right
+        # after recovery, up to one more bucket's worth of requests can be admitted
+        self._failed_at = None
+        self._local_buckets = None
+        return result
+
+    async def wait_for_capacity(self, num_tokens, listen=True):
         await self._init_buckets()
+        amounts = self._get_amounts(num_tokens)
+
+        # With failover, each attempt may be decided by the local buckets instead
+        acquire = None
+        if self._failover:
+            acquire = lambda: self._with_failover(
+                lambda: self._buckets._acquire_async(amounts),
+                lambda: self._local_buckets._acquire(amounts),
+            )
+
         await self._buckets.wait_for_capacity(
-            amounts=[1, num_tokens], sleep_interval=self.sleep_interval
+            amounts=amounts,
+            sleep_interval=self.sleep_interval,
+            acquire=acquire,
+            listen=listen,
         )
 
     def wait_for_capacity_sync(self, num_tokens):
+        # The loop sits idle between sync calls, so don't leave a listener on it
+        loop = utils.ensure_event_loop()
+        loop.run_until_complete(self.wait_for_capacity(num_tokens, listen=False))
+
+    async def _has_capacity_async(self, num_tokens):
+        await self._init_buckets()
+        amounts = self._get_amounts(num_tokens)
+        return await self._with_failover(
+            lambda: self._buckets._has_capacity_async(amounts),
+            lambda: self._local_buckets._has_capacity(amounts),
+        )
+
+    async def _get_wait_time_async(self, num_tokens):
+        await self._init_buckets()
+        amounts = self._get_amounts(num_tokens)
+        return await self._with_failover(
+            lambda: self._buckets._get_wait_time_async(amounts),
+            lambda: self._local_buckets._get_wait_time(amounts),
+        )
+
+    async def _get_wake_event(self):
+        # Set when capacity is freed on any node
+        await self._init_buckets()
+        _, wake_event = self._buckets._get_waiters()
+        return wake_event
+
+    async def refund(self, num_tokens):
+        """
+        Returns unused tokens (e.g. when a response used fewer tokens than counted)
+        and wakes up waiters on every node.
+        """
+
+        await self._init_buckets()
+        amounts = [0] * len(self._request_limits) + [num_tokens] * len(self._token_limits)
+        await self._with_failover(
+            lambda: self._buckets.refund(amounts),
+            lambda: self._local_buckets._refund(amounts),
+        )
+
+    async def close(self):
+        if self._buckets:
+            await self._buckets.close()
+
+    def _has_capacity(self, num_tokens):
+        loop = utils.ensure_event_loop()
+        return loop.run_until_complete(self._has_capacity_async(num_tokens))
+
+    def _get_wait_time(self, num_tokens):
         loop = utils.ensure_event_loop()
-        loop.run_until_complete(self._init_buckets())
-        loop.run_until_complete(self._buckets.wait_for_capacity(
-            amounts=[1, num_tokens], sleep_interval=self.sleep_interval
-        ))
+        return loop.run_until_complete(self._get_wait_time_async(num_tokens))
+
+    async def _count_tokens_async(self, request_params):
+        return await utils.count_tokens_async(
+            self.token_counter,
+            request_params,
+            threshold=self._token_counter_threshold,
+            executor=self._token_counter_executor,
+        )
 
     def limit(self, **kwargs):
-        num_tokens = self.token_counter(**kwargs)
-        return utils.ContextManager(num_tokens, self)
+        return utils.ContextManager(kwargs, self)
 
     def is_limited(self):
         return utils.FunctionDecorator(self)
@@ -103,6 +328,15 @@ class ChatRateLimiterWithRedis(RateLimiterWithRedis):
         redis_url="redis://localhost:5050",
         bucket_size_in_seconds: float = 1,
         bucket_key="chat",
+        redis_cluster: bool = False,
+        compact_state: bool = False,
+        token_counter_threshold: int = utils.DEFAULT_OFFLOAD_THRESHOLD,
+        token_counter_executor=None,
+        failover: bool = False,
+        num_nodes: typing.Optional[int] = None,
+        min_num_nodes: typing.Optional[int] = None,
+        redis_timeout: float = 0.5,
+        failover_retry_interval: float = 5,
     ):
         super().__init__(
             request_limit=request_limit,
@@ -111,6 +345,15 @@ class ChatRateLimiterWithRedis(RateLimiterWithRedis):
             bucket_key=bucket_key,
             redis_url=redis_url,
             bucket_size_in_seconds=bucket_size_in_seconds,
+            redis_cluster=redis_cluster,
+            compact_state=compact_state,
+            token_counter_threshold=token_counter_threshold,
+            token_counter_executor=token_counter_executor,
+            failover=failover,
+            num_nodes=num_nodes,
+            min_num_nodes=min_num_nodes,
+            redis_timeout=redis_timeout,
+            failover_retry_interval=failover_retry_interval,
         )
 
 
@@ -122,6 +365,15 @@ class CompletionRateLimiterWithRedis(RateLimiterWithRedis):
         redis_url="redis://localhost:5050",
         bucket_size_in_seconds: float = 1,
         bucket_key="completion",
+        redis_cluster: bool = False,
+        compact_state: bool = False,
+        token_counter_threshold: int = utils.DEFAULT_OFFLOAD_THRESHOLD,
+        token_counter_executor=None,
+        failover: bool = False,
+        num_nodes: typing.Optional[int] = None,
+        min_num_nodes: typing.Optional[int] = None,
+        redis_timeout: float = 0.5,
+        failover_retry_interval: float = 5,
     ):
         super().__init__(
             request_limit=request_limit,
@@ -130,6 +382,15 @@ class CompletionRateLimiterWithRedis(RateLimiterWithRedis):
             bucket_key=bucket_key,
             redis_url=redis_url,
             bucket_size_in_seconds=bucket_size_in_seconds,
+            redis_cluster=redis_cluster,
+            compact_state=compact_state,
+            token_counter_threshold=token_counter_threshold,
+            token_counter_executor=token_counter_executor,
+            failover=failover,
+            num_nodes=num_nodes,
+            min_num_nodes=min_num_nodes,
+            redis_timeout=redis_timeout,
+            failover_retry_interval=failover_retry_interval,
         )
 
 
@@ -141,6 +402,15 @@ class EmbeddingRateLimiterWithRedis(RateLimiterWithRedis):
         redis_url="redis://localhost:5050",
         bucket_size_in_seconds: float = 1,
         bucket_key="embedding",
+        redis_cluster: bool = False,
+        compact_state: bool = False,
+        token_counter_threshold: int = utils.DEFAULT_OFFLOAD_THRESHOLD,
+        token_counter_executor=None,
+        failover: bool = False,
+        num_nodes: typing.Optional[int] = None,
+        min_num_nodes: typing.Optional[int] = None,
+        redis_timeout: float = 0.5,
+        failover_retry_interval: float = 5,
     ):
         super().__init__(
             request_limit=request_limit,
@@ -149,4 +419,13 @@ class EmbeddingRateLimiterWithRedis(RateLimiterWithRedis):
             bucket_key=bucket_key,
             redis_url=redis_url,
             bucket_size_in_seconds=bucket_size_in_seconds,
+            redis_cluster=redis_cluster,
+            compact_state=compact_state,
+            token_counter_threshold=token_counter_threshold,
+            token_counter_executor=token_counter_executor,
+            failover=failover,
+            num_nodes=num_nodes,
+            min_num_nodes=min_num_nodes,
+            redis_timeout=redis_timeout,
+            failover_retry_interval=failover_retry_interval,
         )
@@ -1,3 +1,4 @@
 from openlimit.utilities.context_decorators import FunctionDecorator, ContextManager
 from openlimit.utilities.ensure_evt_loop import ensure_event_loop
-from openlimit.utilities.token_counters import num_tokens_consumed_by_chat_request, num_tokens_consumed_by_completion_request, num_tokens_consumed_by_embedding_request
\ No newline at end of file
+from openlimit.utilities.token_counters import num_tokens_consumed_by_chat_request, num_tokens_consumed_by_completion_request, num_tokens_consumed_by_embedding_request, count_tokens_async, DEFAULT_OFFLOAD_THRESHOLD
+from openlimit.utilities.rate_limits import normalize_rate_limit, bucket_size_for_window
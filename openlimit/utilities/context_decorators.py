@@ -36,18 +36,22 @@ class ContextManager(object):
     Converts rate limiter into context manager.
     """
 
-    def __init__(self, num_tokens, rate_limiter):
-        self.num_tokens = num_tokens
+    def __init__(self, request_params, rate_limiter):
+        self.request_params = request_params
         self.rate_limiter = rate_limiter
 
     def __enter__(self):
-        self.rate_limiter.wait_for_capacity_sync(self.num_tokens)
+        num_tokens = self.rate_limiter.token_counter(**self.request_params)
+        return self.rate_limiter.wait_for_capacity_sync(num_tokens)
 
     def __exit__(self, *exc):
         return False
 
     async def __aenter__(self):
-        await self.rate_limiter.wait_for_capacity(self.num_tokens)
+        # Tokens are counted here, not in limit(), so large requests can be
+        # tokenized off the event loop
+        num_tokens = await self.rate_limiter._count_tokens_async(self.request_params)
+        return await self.rate_limiter.wait_for_capacity(num_tokens)
 
     async def __aexit__(self, *exc):
         return False
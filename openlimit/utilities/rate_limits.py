@@ -0,0 +1,62 @@
+#########
+# HELPERS
+#########
+
+
+def _is_rate_limit_pair(value):
+    return (
+        isinstance(value, (list, tuple))
+        and len(value) == 2
+        and all(isinstance(v, (int, float)) for v in value)
+    )
+
+
+######
+# MAIN
+######
+
+
+def normalize_rate_limit(rate_limit):
+    """
+    Converts a rate limit into a list of (amount, window_in_seconds) pairs. A
+    number is a per-minute limit, and a single pair like (200, 60) is accepted as
+    is. A list can combine several windows, e.g. [(3500, 60), (10000, 86400)] for
+    3,500 per minute and 10,000 per day.
+    """
+
+    if isinstance(rate_limit, (int, float)):
+        rate_limits = [(rate_limit, 60)]
+    elif _is_rate_limit_pair(rate_limit):
+        rate_limits = [tuple(rate_limit)]
+    elif (
+        isinstance(rate_limit, (list, tuple))
+        and rate_limit
+        and all(_is_rate_limit_pair(limit) for limit in rate_limit)
+    ):
+        rate_limits = [tuple(limit) for limit in rate_limit]
+    else:
+        raise TypeError(
+            "Either a number or a list of (amount, window_in_seconds) pairs expected for rate limit."
+        )
+
+    if any(amount <= 0 or window <= 0 for amount, window in rate_limits):
+        raise ValueError("Rate limit amounts and windows must be positive.")
+
+    windows = [window for _, window in rate_limits]
+    if len(set(windows)) != len(windows):
+        raise ValueError("Each rate limit window can only be given once.")
+
+    return rate_limits
+
+
+def bucket_size_for_window(bucket_size_in_seconds, window_in_seconds):
+    """
+    Scales the bucket size (given for a per-minute window) to another window,
+    so a per-day bucket holds the same fraction of its quota as a per-minute one.
+    Windows shorter than a minute keep the bucket size as-is, but no bucket holds
+    more than its whole window's quota.
+    """
+
+    return min(
+        bucket_size_in_seconds * max(window_in_seconds / 60, 1), window_in_seconds
+    )
@@ -1,3 +1,7 @@
+# Standard library
+import asyncio
+from functools import partial
+
 # Third party
 import tiktoken
 
@@ -5,6 +9,9 @@ import tiktoken
 CL100K_ENCODER = tiktoken.get_encoding("cl100k_base")
 P50K_ENCODER = tiktoken.get_encoding("p50k_base")
 
+# Requests with fewer characters than this are tokenized on the event loop
+DEFAULT_OFFLOAD_THRESHOLD = 10000
+
 
 ######
 # MAIN
@@ -52,3 +59,38 @@ def num_tokens_consumed_by_embedding_request(input, **kwargs):
     raise TypeError(
         "Either a string or list of strings expected for 'input' field in embedding request."
     )
+
+
+def num_chars_in_request(value):
+    """
+    Cheaply sizes request arguments by the length of the strings they contain.
+    """
+
+    if isinstance(value, str):
+        return len(value)
+    elif isinstance(value, dict):
+        return sum(num_chars_in_request(v) for v in value.values())
+    elif isinstance(value, (list, tuple)):
+        return sum(num_chars_in_request(v) for v in value)
+
+    return 0
+
+
+async def count_tokens_async(
+    token_counter,
+    request_params,
+    threshold=DEFAULT_OFFLOAD_THRESHOLD,
+    executor=None,
+):
+    """
+    Counts tokens without blocking the event loop: small requests are counted
+    inline, larger ones in `executor` (the loop's default thread pool if None).
+    """
+
+    if num_chars_in_request(request_params) < threshold:
+        return token_counter(**request_params)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        executor, partial(token_counter, **request_params)
+    )
@@ -0,0 +1,44 @@
+import time
+
+import pytest
+
+from openlimit.buckets import Bucket, Buckets
+
+
+@pytest.fixture
+def frozen_time(monkeypatch):
+    current_time = [time.time()]
+    monkeypatch.setattr(time, "time", lambda: current_time[0])
+    return current_time
+
+def test_buckets_rejected_check_leaves_state_unchanged(frozen_time):
+    # A per-minute bucket with room for 10, and one with room for only 1
+    buckets = Buckets([Bucket(600, 1), Bucket(60, 1)])
+    capacities = list(buckets._capacities)
+    last_checked = buckets._last_checked
+
+    # The first bucket has enough capacity, but the second doesn't
+    assert not buckets._has_capacity([5, 2])
+    assert list(buckets._capacities) == capacities
+    assert buckets._last_checked == last_checked
+
+def test_buckets_successful_check_debits_every_bucket(frozen_time):
+    buckets = Buckets([Bucket(600, 1), Bucket(60, 1)])
+
+    assert buckets._has_capacity([5, 1])
+    assert list(buckets._capacities) == pytest.approx([5, 0])
+
+    # Half a second later, both buckets have refilled at their own rates
+    frozen_time[0] += 0.5
+    assert buckets._has_capacity([5, 0.5])
+    assert list(buckets._capacities) == pytest.approx([5, 0])
+
+def test_buckets_wait_time_is_max_over_windows(frozen_time):
+    # 10 per second for a minute window, 1 per minute for an hour window
+    buckets = Buckets([Bucket(600, 1), Bucket(60, 60, 3600)])
+
+    assert buckets._has_capacity([10, 1])
+
+    # The minute bucket refills 1 unit in 0.1s, the hour bucket in 60s
+    assert buckets._get_wait_time([1, 1]) == pytest.approx(60)
+    assert buckets._get_wait_time([1, 0]) == pytest.approx(0.1)
@@ -0,0 +1,88 @@
+import asyncio
+import time
+
+import pytest
+
+from openlimit import ChatRateLimiter, RateLimiterPool
+
+
+@pytest.fixture(scope="module")
+def chat_params():
+    return {
+        "messages": [
+            {"role": "system", "content": "You are a helpful assistant."},
+            {"role": "user", "content": "Who won the world series in 2020?"}
+        ],
+        "max_tokens": 1,
+        "n": 1
+    }
+
+def test_rate_limiter_pool_sync(chat_params):
+    rate_limiter_pool = RateLimiterPool({
+        "key-1": ChatRateLimiter(request_limit=200, token_limit=4000),
+        "key-2": ChatRateLimiter(request_limit=200, token_limit=4000),
+    })
+
+    start_time = time.time()
+    duration = 5  # seconds
+    calls_per_key = {"key-1": 0, "key-2": 0}
+
+    while (time.time() - start_time) < duration:
+        with rate_limiter_pool.limit(**chat_params) as key:
+            calls_per_key[key] += 1
+
+    # Both keys should be used, and the pool should stay within their combined limits
+    assert all(calls > 0 for calls in calls_per_key.values())
+    assert sum(calls_per_key.values()) <= 2 * 200 * (duration / 60) + 2 * 200 / 60
+
+@pytest.mark.asyncio
+async def test_rate_limiter_pool_async(chat_params):
+    rate_limiter_pool = RateLimiterPool({
+        "key-1": ChatRateLimiter(request_limit=200, token_limit=4000),
+        "key-2": ChatRateLimiter(request_limit=200, token_limit=4000),
+    })
+
+    start_time = asyncio.get_event_loop().time()
+    duration = 5  # seconds
+    calls_per_key = {"key-1": 0, "key-2": 0}
+
+    while (asyncio.get_event_loop().time() - start_time) < duration:
+        async with rate_limiter_pool.limit(**chat_params) as key:
+            calls_per_key[key] += 1
+
+    # Both keys should be used, and the pool should stay within their combined limits
+    assert all(calls > 0 for calls in calls_per_key.values())
+    assert sum(calls_per_key.values()) <= 2 * 200 * (duration / 60) + 2 * 200 / 60
+
+@pytest.mark.asyncio
+async def test_rate_limiter_pool_spills_over(chat_params):
+    rate_limiter_pool = RateLimiterPool({
+        "small": ChatRateLimiter(request_limit=60, token_limit=4000),
+        "large": ChatRateLimiter(request_limit=600, token_limit=40000),
+    })
+
+    start_time = asyncio.get_event_loop().time()
+    duration = 3  # seconds
+    calls_per_key = {"small": 0, "large": 0}
+
+    while (asyncio.get_event_loop().time() - start_time) < duration:
+        async with rate_limiter_pool.limit(**chat_params) as key:
+            calls_per_key[key] += 1
+
+    # The small quota saturates after its first few requests, so traffic moves to the large one
+    assert 0 < calls_per_key["small"] <= 60 / 60 + 60 * (duration / 60) + 1
+    assert calls_per_key["large"] > 5 * calls_per_key["small"]
+
+def test_rate_limiter_pool_balances_equal_keys(chat_params):
+    rate_limiter_pool = RateLimiterPool({
+        "key-1": ChatRateLimiter(request_limit=600, token_limit=60000),
+        "key-2": ChatRateLimiter(request_limit=600, token_limit=60000),
+    })
+
+    calls_per_key = {"key-1": 0, "key-2": 0}
+    for _ in range(10):
+        with rate_limiter_pool.limit(**chat_params) as key:
+            calls_per_key[key] += 1
+
+    # Both keys have a full burst, so ties alternate between them instead of draining key-1
+    assert calls_per_key == {"key-1": 5, "key-2": 5}
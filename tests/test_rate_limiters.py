@@ -70,4 +70,78 @@ async def test_rate_limiter_within_limits_async(chat_params):
     successful_calls = await count_successful_calls(duration)
 
     # Check if the number of successful calls is within the rate limits
-    assert 0 < successful_calls <= rate_limiter_async.request_limit * (duration / 60)
\ No newline at end of file
+    assert 0 < successful_calls <= rate_limiter_async.request_limit * (duration / 60)
+
+def test_rate_limiter_multiple_windows_sync(chat_params):
+    # 200 requests per minute, but only 600 per hour
+    rate_limiter = ChatRateLimiter(
+        request_limit=[(200, 60), (600, 3600)],
+        token_limit=[(4000, 60), (100000, 86400)]
+    )
+
+    start_time = time.time()
+    duration = 5  # seconds
+    successful_calls = 0
+
+    while (time.time() - start_time) < duration:
+        with rate_limiter.limit(**chat_params):
+            successful_calls += 1
+
+    # The hourly limit is the binding one: its bucket holds 600 / 60 requests
+    elapsed = time.time() - start_time
+    assert 0 < successful_calls <= 600 / 60 + 600 * (elapsed / 3600)
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_offloads_large_requests(chat_params):
+    import threading
+
+    from openlimit.rate_limiters import RateLimiter
+
+    counted_in_threads = []
+
+    def token_counter(**kwargs):
+        counted_in_threads.append(threading.get_ident())
+        return 1
+
+    rate_limiter = RateLimiter(
+        request_limit=200,
+        token_limit=4000,
+        token_counter=token_counter,
+        token_counter_threshold=100
+    )
+
+    # Small requests are counted on the event loop, large ones in a worker thread
+    async with rate_limiter.limit(messages=[{"role": "user", "content": "Hi"}]):
+        pass
+    async with rate_limiter.limit(messages=[{"role": "user", "content": "Hi" * 100}]):
+        pass
+
+    assert counted_in_threads[0] == threading.get_ident()
+    assert counted_in_threads[1] != threading.get_ident()
+
+
+def test_rate_limiter_validates_limits():
+    rate_limiter = ChatRateLimiter(request_limit=(200, 60), token_limit=4000)
+    assert rate_limiter._request_limits == [(200, 60)]
+
+    with pytest.raises(ValueError):
+        ChatRateLimiter(request_limit=0, token_limit=4000)
+    with pytest.raises(ValueError):
+        ChatRateLimiter(request_limit=[(200, 60), (100, 0)], token_limit=4000)
+    with pytest.raises(ValueError):
+        ChatRateLimiter(request_limit=[(200, 60), (300, 60)], token_limit=4000)
+    with pytest.raises(TypeError):
+        ChatRateLimiter(request_limit=[(200, 60, 1)], token_limit=4000)
+
+def test_rate_limiter_caps_sub_minute_buckets():
+    rate_limiter = ChatRateLimiter(
+        request_limit=[(200, 60), (5, 1)], token_limit=40000, bucket_size_in_seconds=10
+    )
+
+    successful_calls = 0
+    while rate_limiter._has_capacity(1):
+        successful_calls += 1
+
+    # The per-second bucket holds at most one second's quota, despite the 10-second bucket size
+    assert successful_calls == 5
@@ -2,8 +2,9 @@ import time
 
 import asyncio
 import pytest
+import redis
 
-from openlimit import ChatRateLimiterWithRedis
+from openlimit import ChatRateLimiterWithRedis, RateLimiterPool
 
 @pytest.fixture(scope="module")
 def chat_params():
@@ -16,6 +17,18 @@ def chat_params():
         "n": 1
     }
 
+@pytest.fixture
+def fake_redis(monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    server = fakeredis.FakeServer()
+    db = fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+    def from_url(*args, **kwargs):
+        return fakeredis.FakeAsyncRedis(server=server, decode_responses=True)
+
+    monkeypatch.setattr(redis.asyncio, "from_url", from_url)
+    return db
+
 @pytest.mark.asyncio
 async def test_rate_limiter_with_redis(chat_params):
     rate_limiter_async = ChatRateLimiterWithRedis(
@@ -38,4 +51,294 @@ async def test_rate_limiter_with_redis(chat_params):
             successful_calls += 1
 
     # Check if the number of successful calls is within the rate limits
-    assert 0 < successful_calls <= rate_limiter_async.request_limit * (duration / 60)
\ No newline at end of file
+    assert 0 < successful_calls <= rate_limiter_async.request_limit * (duration / 60)
+
+@pytest.mark.asyncio
+async def test_rate_limiter_with_redis_failover(chat_params):
+    rate_limiter_async = ChatRateLimiterWithRedis(
+        request_limit=200,
+        token_limit=4000,
+        redis_url="redis://localhost:1",  # Unreachable
+        failover=True,
+        num_nodes=2,
+        redis_timeout=0.1
+    )
+
+    start_time = asyncio.get_event_loop().time()
+    duration = 5  # seconds
+    successful_calls = 0
+
+    while (asyncio.get_event_loop().time() - start_time) < duration:
+        async with rate_limiter_async.limit(**chat_params):
+            successful_calls += 1
+
+    # Without Redis, this node should stay within its half of the rate limits
+    assert 0 < successful_calls <= (rate_limiter_async.request_limit / 2) * (duration / 60) + 2
+
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_with_redis_keys_share_slot(chat_params, fake_redis):
+    chat_rate_limiter = ChatRateLimiterWithRedis(request_limit=200, token_limit=4000, bucket_key="chat")
+    other_rate_limiter = ChatRateLimiterWithRedis(request_limit=200, token_limit=4000, bucket_key="other")
+
+    async with chat_rate_limiter.limit(**chat_params):
+        pass
+    async with other_rate_limiter.limit(**chat_params):
+        pass
+
+    chat_keys = await fake_redis.keys("{chat}*")
+    other_keys = await fake_redis.keys("{other}*")
+
+    # All keys of one limiter live in the same Redis Cluster slot, different limiters in different slots
+    chat_slots = {redis.cluster.key_slot(key.encode()) for key in chat_keys}
+    other_slots = {redis.cluster.key_slot(key.encode()) for key in other_keys}
+    assert len(chat_keys) == 4 and len(chat_slots) == 1
+    assert len(other_keys) == 4 and len(other_slots) == 1
+    assert chat_slots != other_slots
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_with_redis_compact_state(chat_params, fake_redis):
+    rate_limiter = ChatRateLimiterWithRedis(
+        request_limit=200,
+        token_limit=4000,
+        bucket_size_in_seconds=10,
+        compact_state=True
+    )
+
+    async with rate_limiter.limit(**chat_params):
+        pass
+
+    # All state lives in one hash, expiring once the buckets would be full again
+    assert await fake_redis.keys("{chat}*") == ["{chat}_state"]
+    assert await fake_redis.ttl("{chat}_state") == 10
+    assert sorted(await fake_redis.hkeys("{chat}_state")) == [
+        "requests:capacity", "requests:last_checked", "tokens:capacity", "tokens:last_checked"
+    ]
+
+    # An expired hash reads as full buckets
+    await fake_redis.delete("{chat}_state")
+    capacities = await rate_limiter._buckets._get_capacities()
+    assert capacities == pytest.approx([200 / 60 * 10, 4000 / 60 * 10])
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_with_redis_failover_holds_global_limit(chat_params, fake_redis):
+    # Eight nodes contending for the same healthy Redis
+    rate_limiters = [
+        ChatRateLimiterWithRedis(
+            request_limit=600,
+            token_limit=60000,
+            failover=True,
+            num_nodes=8
+        )
+        for _ in range(8)
+    ]
+
+    start_time = asyncio.get_event_loop().time()
+    duration = 3  # seconds
+    successful_calls = 0
+    failed_over = False
+
+    async def run_node(rate_limiter):
+        nonlocal successful_calls, failed_over
+        while (asyncio.get_event_loop().time() - start_time) < duration:
+            async with rate_limiter.limit(**chat_params):
+                successful_calls += 1
+                failed_over = failed_over or rate_limiter._failed_at is not None
+
+    await asyncio.gather(*[run_node(rate_limiter) for rate_limiter in rate_limiters])
+    elapsed = asyncio.get_event_loop().time() - start_time
+
+    # Lock contention must not be mistaken for an outage, so the global limit holds
+    assert not failed_over
+    assert 0 < successful_calls <= 600 / 60 + 600 * (elapsed / 60) + 1
+
+
+@pytest.mark.asyncio
+async def test_rate_limiter_with_redis_failover_with_many_nodes():
+    rate_limiter = ChatRateLimiterWithRedis(
+        request_limit=200,
+        token_limit=4000,
+        redis_url="redis://localhost:1",  # Nothing listens here
+        failover=True,
+        num_nodes=16,
+        redis_timeout=0.1
+    )
+
+    # A node's share of the rate is below one request per bucket, but a request
+    # (even one as large as the whole token bucket) must still get through
+    await asyncio.wait_for(rate_limiter.wait_for_capacity(1), timeout=5)
+    await asyncio.wait_for(rate_limiter.wait_for_capacity(4000 / 60), timeout=5)
+
+    assert rate_limiter._failed_at is not None
+
+@pytest.mark.asyncio
+async def test_rate_limiter_with_redis_fails_over_when_slow(fake_redis, monkeypatch):
+    from openlimit.buckets import RedisBuckets
+
+    async def slow_acquire_async(self, amounts):
+        await asyncio.sleep(1)
+        return True, 0.0
+
+    monkeypatch.setattr(RedisBuckets, "_acquire_async", slow_acquire_async)
+
+    rate_limiter = ChatRateLimiterWithRedis(
+        request_limit=600,
+        token_limit=60000,
+        failover=True,
+        num_nodes=2,
+        redis_timeout=0.1
+    )
+
+    # A reachable but unresponsive Redis is bounded by redis_timeout too
+    start_time = time.time()
+    await rate_limiter.wait_for_capacity(1)
+
+    assert time.time() - start_time < 0.5
+    assert rate_limiter._failed_at is not None
+
+    await rate_limiter.close()
+
+@pytest.mark.asyncio
+async def test_redis_buckets_expired_lock_fails_decision(fake_redis, monkeypatch):
+    from openlimit.buckets import RedisBucket, RedisBuckets
+
+    buckets = RedisBuckets(
+        buckets=[RedisBucket(600, bucket_key="{test}_requests", redis=fake_redis)],
+        redis=fake_redis,
+        lock_timeout=0.1,
+    )
+    get_capacities = buckets._get_capacities
+
+    async def slow_get_capacities(*args, **kwargs):
+        await asyncio.sleep(0.3)
+        return await get_capacities(*args, **kwargs)
+
+    monkeypatch.setattr(buckets, "_get_capacities", slow_get_capacities)
+
+    # The lock expires mid-decision, so the decision doesn't count instead of crashing
+    assert await buckets._acquire_async([1]) == (False, 0.0)
+
+@pytest.mark.asyncio
+async def test_rate_limiter_with_redis_refund(fake_redis):
+    # Requests with no messages and max_tokens=8 count as 10 tokens, a full token bucket
+    rate_limiter = ChatRateLimiterWithRedis(request_limit=6000, token_limit=600)
+
+    async with rate_limiter.limit(messages=[], max_tokens=8):
+        pass
+    assert (await rate_limiter._buckets._get_capacities())[1] < 1
+
+    await rate_limiter.refund(10)
+    assert (await rate_limiter._buckets._get_capacities())[1] == pytest.approx(10)
+
+    await rate_limiter.close()
+
+@pytest.mark.asyncio
+async def test_rate_limiter_with_redis_refund_wakes_other_nodes(fake_redis):
+    node_a = ChatRateLimiterWithRedis(request_limit=6000, token_limit=600)
+    node_b = ChatRateLimiterWithRedis(request_limit=6000, token_limit=600)
+
+    async with node_a.limit(messages=[], max_tokens=8):
+        pass
+
+    async def wait_on_node_b():
+        start_time = asyncio.get_event_loop().time()
+        async with node_b.limit(messages=[], max_tokens=8):
+            return asyncio.get_event_loop().time() - start_time
+
+    waiter = asyncio.create_task(wait_on_node_b())
+    await asyncio.sleep(0.1)
+    await node_a.refund(10)
+
+    # Without the refund, node B's capacity would only be due after a second
+    assert await waiter < 0.5
+
+    await node_a.close()
+    await node_b.close()
+
+@pytest.mark.asyncio
+async def test_rate_limiter_with_redis_waiters_queue_locally(chat_params, fake_redis, monkeypatch):
+    from openlimit.buckets import RedisBuckets
+
+    num_checks = 0
+    acquire_async = RedisBuckets._acquire_async
+
+    async def counting_acquire_async(self, amounts):
+        nonlocal num_checks
+        num_checks += 1
+        return await acquire_async(self, amounts)
+
+    monkeypatch.setattr(RedisBuckets, "_acquire_async", counting_acquire_async)
+
+    rate_limiter = ChatRateLimiterWithRedis(request_limit=600, token_limit=60000)
+
+    async def run_rate_limited_function():
+        async with rate_limiter.limit(**chat_params):
+            return 1
+
+    # Twenty concurrent waiters for 20 admissions: only the head waiter checks Redis,
+    # and it sleeps until its capacity is due instead of polling
+    successful_calls = sum(await asyncio.gather(*[run_rate_limited_function() for _ in range(20)]))
+
+    assert successful_calls == 20
+    assert num_checks <= 2 * successful_calls
+
+    await rate_limiter.close()
+
+@pytest.mark.asyncio
+async def test_rate_limiter_pool_with_redis_queues_waiters(chat_params, fake_redis, monkeypatch):
+    from openlimit.buckets import RedisBuckets
+
+    num_checks = 0
+    get_wait_time_async = RedisBuckets._get_wait_time_async
+
+    async def counting_get_wait_time_async(self, amounts):
+        nonlocal num_checks
+        num_checks += 1
+        return await get_wait_time_async(self, amounts)
+
+    monkeypatch.setattr(RedisBuckets, "_get_wait_time_async", counting_get_wait_time_async)
+
+    rate_limiter_pool = RateLimiterPool({
+        "key-1": ChatRateLimiterWithRedis(request_limit=600, token_limit=60000, bucket_key="key-1"),
+        "key-2": ChatRateLimiterWithRedis(request_limit=600, token_limit=60000, bucket_key="key-2"),
+    })
+
+    async def run_rate_limited_function():
+        async with rate_limiter_pool.limit(**chat_params) as key:
+            return key
+
+    # Forty concurrent waiters: only the head waiter reads the state of both keys
+    keys = await asyncio.gather(*[run_rate_limited_function() for _ in range(40)])
+
+    assert keys.count("key-1") > 0 and keys.count("key-2") > 0
+    assert num_checks <= 2 * 2 * len(keys)
+
+    for rate_limiter in rate_limiter_pool.rate_limiters.values():
+        await rate_limiter.close()
+
+def test_rate_limiter_with_redis_across_event_loops(chat_params, fake_redis):
+    rate_limiter = ChatRateLimiterWithRedis(request_limit=600, token_limit=60000)
+
+    async def run_rate_limited_function():
+        async with rate_limiter.limit(**chat_params):
+            return rate_limiter._buckets._listener
+
+    # Each event loop gets its own waiter queue and wake-up listener
+    first_listener = asyncio.run(run_rate_limited_function())
+    second_listener = asyncio.run(run_rate_limited_function())
+
+    assert first_listener is not second_listener
+    assert first_listener.done()
+
+def test_rate_limiter_with_redis_sync_leaves_no_listener(chat_params, fake_redis):
+    rate_limiter = ChatRateLimiterWithRedis(request_limit=600, token_limit=60000)
+
+    for _ in range(3):
+        with rate_limiter.limit(**chat_params):
+            pass
+
+    # The sync path's event loop sits idle between calls, so nothing listens on it
+    assert rate_limiter._buckets._listener is None